@@ -0,0 +1,109 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+# 嵌入后端配置，可选: openai / hashing
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
+# 本地哈希向量化配置
+HASHING_N_FEATURES = int(os.getenv("HASHING_N_FEATURES", "1024"))
+HASHING_NGRAM_RANGE = (1, 3)
+# 超过该条数的批量编码才会分发到进程池
+HASHING_PROCESS_THRESHOLD = 5000
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", "0"))
+
+def _char_ngrams(text, ngram_range):
+    """提取字符n-gram，中文无需分词即可得到稳定的特征"""
+    text = "".join(text.split())
+    min_n, max_n = ngram_range
+    for n in range(min_n, max_n + 1):
+        for i in range(len(text) - n + 1):
+            yield text[i:i + n]
+
+def _hash_encode(texts, n_features, ngram_range):
+    """将一批文本编码为L2归一化的float32矩阵"""
+    rows = []
+    hashes = []
+    for row, text in enumerate(texts):
+        # crc32在不同进程间结果一致，不受PYTHONHASHSEED影响
+        text_hashes = [zlib.crc32(gram.encode("utf-8")) for gram in _char_ngrams(text, ngram_range)]
+        hashes.extend(text_hashes)
+        rows.extend([row] * len(text_hashes))
+
+    hashes = np.asarray(hashes, dtype=np.uint32)
+    rows = np.asarray(rows, dtype=np.int64)
+
+    # 低位决定特征桶，最高位决定符号，减少哈希冲突带来的偏差
+    columns = (hashes % n_features).astype(np.int64)
+    signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+
+    matrix = np.bincount(
+        rows * n_features + columns,
+        weights=signs,
+        minlength=len(texts) * n_features
+    ).astype(np.float32).reshape(len(texts), n_features)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class HashingEmbeddings(Embeddings):
+    """基于字符n-gram哈希的本地CPU嵌入，无需网络，适合离线部署和测试"""
+
+    def __init__(self, n_features=HASHING_N_FEATURES, ngram_range=HASHING_NGRAM_RANGE,
+                 workers=HASHING_WORKERS, process_threshold=HASHING_PROCESS_THRESHOLD):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.workers = workers
+        self.process_threshold = process_threshold
+
+    def encode(self, texts):
+        """批量编码，返回形状为(len(texts), n_features)的NumPy矩阵"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.n_features), dtype=np.float32)
+
+        # 大批量重建索引时分块交给进程池并行编码
+        if self.workers > 1 and len(texts) >= self.process_threshold:
+            chunk_size = -(-len(texts) // self.workers)
+            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                parts = executor.map(
+                    _hash_encode,
+                    chunks,
+                    [self.n_features] * len(chunks),
+                    [self.ngram_range] * len(chunks)
+                )
+                return np.vstack(list(parts))
+
+        return _hash_encode(texts, self.n_features, self.ngram_range)
+
+    @property
+    def signature(self):
+        """完整的向量化配置，特征维度或n-gram范围变化后旧向量不再可比"""
+        min_n, max_n = self.ngram_range
+        return f"hashing:{self.n_features}:{min_n}-{max_n}"
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+def create_embeddings(backend, openai_api_key=None):
+    """根据配置创建嵌入后端"""
+    if backend == "openai":
+        return OpenAIEmbeddings(openai_api_key=openai_api_key)
+    if backend == "hashing":
+        return HashingEmbeddings()
+    raise ValueError(f"未知的嵌入后端: {backend}")
+
+def embedding_signature(backend, embeddings):
+    """返回记录在向量库元数据中的嵌入配置标识"""
+    # openai保持原名，兼容未记录该字段的旧集合
+    if isinstance(embeddings, HashingEmbeddings):
+        return embeddings.signature
+    return backend
@@ -0,0 +1,123 @@
+import os
+import socket
+import struct
+import secrets
+import multiprocessing
+from multiprocessing.connection import Client, Connection, answer_challenge, deliver_challenge
+
+# 索引写入进程配置，INDEX_WRITER_ADDRESS 为空时各进程直接写本地向量库
+INDEX_WRITER_ADDRESS = os.getenv("INDEX_WRITER_ADDRESS", "")
+INDEX_WRITER_AUTHKEY = os.getenv("INDEX_WRITER_AUTHKEY", "")
+INDEX_WRITER_PORT = int(os.getenv("INDEX_WRITER_PORT", "8765"))
+# 握手、读取请求和回复时单次等待的最长秒数，避免一个卡住的连接阻塞唯一的写入进程
+WRITER_RECV_TIMEOUT = 30
+# 等待处理的连接队列长度，多个worker同时提交写请求时不被拒绝
+WRITER_BACKLOG = 64
+
+# 允许请求进程远程调用的写操作
+WRITER_METHODS = {"add_knowledge"}
+
+def _parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+class IndexWriterClient:
+    """请求进程侧的客户端，把向量库写操作转发给索引写入进程"""
+
+    def __init__(self, address, authkey):
+        self.address = _parse_address(address)
+        self.authkey = authkey.encode()
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量创建客户端，未配置写入进程时返回None"""
+        if not INDEX_WRITER_ADDRESS:
+            return None
+        return cls(INDEX_WRITER_ADDRESS, INDEX_WRITER_AUTHKEY)
+
+    def _call(self, method, *args):
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send((method, args))
+            status, result = conn.recv()
+        if status == "error":
+            raise RuntimeError(f"索引写入进程出错: {result}")
+        return result
+
+    def add_knowledge(self, knowledge_items):
+        return self._call("add_knowledge", knowledge_items)
+
+def _accept(server, authkey):
+    """接受一个连接并完成认证握手，所有读写都受 WRITER_RECV_TIMEOUT 限制
+
+    multiprocessing的Listener在握手阶段会无限期阻塞，这里改为在套接字上设置收发超时后自行握手。
+    """
+    sock, _ = server.accept()
+    timeout = struct.pack("ll", int(WRITER_RECV_TIMEOUT), int(WRITER_RECV_TIMEOUT % 1 * 1000000))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeout)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeout)
+    conn = Connection(sock.detach())
+    try:
+        deliver_challenge(conn, authkey)
+        answer_challenge(conn, authkey)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+def serve(address, authkey, ready=None, rag_system=None):
+    """索引写入进程主循环：唯一持有向量库写权限，按到达顺序串行处理写请求"""
+    if rag_system is None:
+        from rag import RAGSystem
+        rag_system = RAGSystem()
+
+    with socket.create_server(_parse_address(address), backlog=WRITER_BACKLOG) as server:
+        if ready is not None:
+            ready.set()
+        while True:
+            try:
+                conn = _accept(server, authkey.encode())
+            except Exception as e:
+                print(f"索引写入进程拒绝连接: {e}")
+                continue
+            with conn:
+                try:
+                    if not conn.poll(WRITER_RECV_TIMEOUT):
+                        print("索引写入进程等待请求超时，已断开连接")
+                        continue
+                    method, args = conn.recv()
+                except Exception as e:
+                    print(f"索引写入进程读取请求失败: {e}")
+                    continue
+
+                try:
+                    if method not in WRITER_METHODS:
+                        raise ValueError(f"不支持的写操作: {method}")
+                    reply = ("ok", getattr(rag_system, method)(*args))
+                except Exception as e:
+                    reply = ("error", str(e))
+
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    # 客户端已断开或不再读取，结果无人接收，继续服务后续请求
+                    continue
+
+def start_index_writer():
+    """启动索引写入进程，并通过环境变量把地址和密钥传给之后启动的worker"""
+    from rag import VECTOR_STORE_BACKEND
+
+    # Chroma持久化客户端不支持多进程共享，多进程模式只能使用内存映射索引
+    if VECTOR_STORE_BACKEND != "mmap":
+        raise ValueError("多进程部署需要设置 VECTOR_STORE_BACKEND=mmap")
+
+    address = os.environ.setdefault("INDEX_WRITER_ADDRESS", f"127.0.0.1:{INDEX_WRITER_PORT}")
+    authkey = os.environ.setdefault("INDEX_WRITER_AUTHKEY", secrets.token_hex(16))
+
+    # 不能设为守护进程：守护进程无法再创建子进程，重建索引时嵌入后端的进程池将不可用
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(address, authkey, ready))
+    process.start()
+    while not ready.wait(0.5):
+        if not process.is_alive():
+            raise RuntimeError("索引写入进程启动失败")
+    return process
@@ -0,0 +1,52 @@
+"""RAG检索压测脚本
+
+分别以不同的 UVICORN_WORKERS 启动服务后运行本脚本，比较吞吐量随worker数量的变化，例如:
+
+    EMBEDDING_BACKEND=hashing VECTOR_STORE_BACKEND=mmap UVICORN_WORKERS=4 python main.py
+    python load_test.py --requests 2000 --concurrency 32
+
+只做检索不调用LLM（generate=false），避免上游接口限速掩盖服务端的扩展性。
+"""
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+QUERIES = ["今天的会议讨论了什么", "下周的旅行计划", "项目预算", "读书笔记", "跑步记录"]
+
+def send_request(url, batch_size):
+    payload = {
+        "queries": [QUERIES[i % len(QUERIES)] for i in range(batch_size)],
+        "generate": False
+    }
+    request = urllib.request.Request(
+        f"{url}/rag/query/batch",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG检索压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = sorted(executor.map(lambda _: send_request(args.url, args.batch_size), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"请求数: {args.requests}  并发: {args.concurrency}  耗时: {elapsed:.2f}s")
+    print(f"吞吐量: {args.requests / elapsed:.1f} 请求/秒")
+    print(f"延迟 p50: {latencies[len(latencies) // 2] * 1000:.1f}ms  p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
 import uvicorn
@@ -9,12 +11,15 @@ import os
 import uuid
 from geopy.geocoders import Nominatim
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import sqlite3
+import json
 from pathlib import Path
 import openai
-from rag import initialize_rag_system, get_knowledge_items_from_db
+from rag import initialize_rag_system, get_knowledge_items_from_db, MAX_BATCH_QUERIES
+from index_writer import start_index_writer
 
 # JWT配置
 SECRET_KEY = "your-secret-key-change-in-production"
@@ -25,10 +30,17 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 OPENAI_API_KEY = "your-openai-api-key"
 openai.api_key = OPENAI_API_KEY
 
-app = FastAPI(title="个人知识库API", description="个人知识库后端API服务")
+# RAG系统在应用启动时初始化，多进程模式下只在实际处理请求的worker中创建，
+# 不会在主进程或worker导入本模块时重复创建
+rag_system = None
 
-# 初始化RAG系统
-rag_system = initialize_rag_system()
+@asynccontextmanager
+async def lifespan(app):
+    global rag_system
+    rag_system = initialize_rag_system()
+    yield
+
+app = FastAPI(title="个人知识库API", description="个人知识库后端API服务", lifespan=lifespan)
 
 # 添加CORS中间件以允许前端访问
 app.add_middleware(
@@ -87,6 +99,12 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
 
+class RAGBatchQueryRequest(BaseModel):
+    queries: List[str]
+    user_id: Optional[int] = None
+    generate: bool = True
+    max_concurrency: int = 4
+
 # 数据库文件路径
 DB_FILE = Path("knowledge_base.db")
 
@@ -139,6 +157,30 @@ def query_rag(query: str, user_id: Optional[int] = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"RAG查询时出错: {e}")
 
+@app.post("/rag/query/batch")
+async def query_rag_batch(request: RAGBatchQueryRequest):
+    """批量RAG查询，按输入顺序以NDJSON流式返回结果"""
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="查询列表不能为空")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {MAX_BATCH_QUERIES} 个问题")
+    if request.max_concurrency < 1:
+        raise HTTPException(status_code=400, detail="max_concurrency必须大于0")
+    
+    try:
+        # 一次嵌入请求 + 一次向量检索，放到线程池中避免阻塞事件循环
+        retrieved = await run_in_threadpool(rag_system.retrieve_batch, request.queries, request.user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"RAG批量检索时出错: {e}")
+    
+    async def stream_results():
+        async for result in rag_system.generate_batch(
+            request.queries, retrieved, request.generate, request.max_concurrency
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/rag/update")
 def update_rag():
     """更新RAG向量数据库（重新加载所有知识条目）"""
@@ -535,4 +577,14 @@ def read_root():
     return {"message": "欢迎使用个人知识库API"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    if workers > 1:
+        # 多进程模式：单独的索引写入进程负责全部向量写入，worker通过本地IPC转发写请求
+        index_writer_process = start_index_writer()
+        try:
+            uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+        finally:
+            index_writer_process.terminate()
+            index_writer_process.join()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,6 +1,6 @@
 import os
+import asyncio
 from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains import RetrievalQA
 from langchain_openai import OpenAI
@@ -8,6 +8,9 @@ from langchain.docstore.document import Document
 import sqlite3
 from pathlib import Path
 import openai
+from embeddings import EMBEDDING_BACKEND, create_embeddings, embedding_signature
+from vectorstore import MmapVectorStore, MMAP_INDEX_PATH
+from index_writer import IndexWriterClient
 
 # OpenAI配置
 OPENAI_API_KEY = "your-openai-api-key"
@@ -16,10 +19,19 @@ openai.api_key = OPENAI_API_KEY
 # Chroma数据库路径
 CHROMA_DB_PATH = "./chroma_db"
 
+# 向量存储后端，可选: chroma / mmap
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+
+# 批量查询上限：单次请求的问题数，以及同时进行的LLM生成请求数
+MAX_BATCH_QUERIES = 64
+MAX_BATCH_CONCURRENCY = 8
+
 class RAGSystem:
-    def __init__(self):
+    def __init__(self, embedding_backend=EMBEDDING_BACKEND, vector_store_backend=VECTOR_STORE_BACKEND,
+                 index_writer=None):
         # 初始化嵌入模型
-        self.embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+        self.embedding_backend = embedding_backend
+        self.embeddings = create_embeddings(embedding_backend, openai_api_key=OPENAI_API_KEY)
         
         # 初始化文本分割器
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -34,14 +46,47 @@ class RAGSystem:
             max_tokens=500
         )
         
-        # 初始化Chroma向量数据库
-        self.vectorstore = Chroma(
-            persist_directory=CHROMA_DB_PATH,
-            embedding_function=self.embeddings
-        )
+        if index_writer is not None and vector_store_backend != "mmap":
+            raise ValueError("使用索引写入进程时需要设置 VECTOR_STORE_BACKEND=mmap")
+        
+        # 初始化向量数据库，并在集合元数据中记录产生向量的嵌入后端及其完整配置
+        signature = embedding_signature(embedding_backend, self.embeddings)
+        collection_metadata = {"embedding_backend": signature}
+        if vector_store_backend == "chroma":
+            self.vectorstore = Chroma(
+                persist_directory=CHROMA_DB_PATH,
+                embedding_function=self.embeddings,
+                collection_metadata=collection_metadata
+            )
+            stored_metadata = self.vectorstore._collection.metadata or {}
+            store_path = CHROMA_DB_PATH
+        elif vector_store_backend == "mmap":
+            # 多进程模式下写操作交给索引写入进程，本进程只读打开索引；写入后的新数据会自动映射进来
+            self.vectorstore = MmapVectorStore(
+                embedding_function=self.embeddings,
+                collection_metadata=collection_metadata,
+                read_only=index_writer is not None
+            )
+            stored_metadata = self.vectorstore.metadata
+            store_path = MMAP_INDEX_PATH
+        else:
+            raise ValueError(f"未知的向量存储后端: {vector_store_backend}")
+        
+        # 已有集合由其他后端生成时，向量维度与语义都不兼容，拒绝混用
+        stored_backend = stored_metadata.get("embedding_backend", "openai")
+        if stored_backend != signature:
+            raise ValueError(
+                f"向量数据库由嵌入后端 {stored_backend} 生成，与当前配置 {signature} 不一致，请清空 {store_path} 后重建索引"
+            )
+        
+        # 配置了索引写入进程时，写操作转发给它
+        self.index_writer = index_writer
     
     def add_knowledge(self, knowledge_items):
         """将知识条目添加到向量数据库中"""
+        if self.index_writer is not None:
+            return self.index_writer.add_knowledge(knowledge_items)
+        
         documents = []
         ids = []
         
@@ -71,29 +116,92 @@ class RAGSystem:
     def query_knowledge(self, query, user_id=None):
         """使用RAG查询知识"""
         # 执行检索
-        results = self.vectorstore.similarity_search(query, k=4)  # 返回最相关的4个结果
-        
-        # 获取上下文
-        context = "\n\n".join([doc.page_content for doc in results])
-        
-        # 构建提示
-        prompt = f"基于以下上下文回答问题:\n\n{context}\n\n问题: {query}\n\n回答:"
+        search_filter = {"user_id": user_id} if user_id is not None else None
+        results = self.vectorstore.similarity_search(query, k=4, filter=search_filter)  # 返回最相关的4个结果
         
         # 生成回答
-        response = self.llm.invoke(prompt)
+        response = self.llm.invoke(self._build_prompt(query, results))
         
         return {
             "query": query,
             "response": response,
-            "sources": [
-                {
-                    "title": doc.metadata.get("title", ""),
-                    "category": doc.metadata.get("category", ""),
-                    "content": doc.page_content
-                } 
-                for doc in results
-            ]
+            "sources": self._format_sources(results)
         }
+    
+    def retrieve_batch(self, queries, user_id=None, k=4):
+        """批量检索：一次嵌入请求 + 一次向量查询，返回与queries顺序一致的文档列表"""
+        # 所有问题合并为一次嵌入请求
+        query_embeddings = self.embeddings.embed_documents(queries)
+        
+        # 所有向量一次性提交给向量数据库检索
+        where = {"user_id": user_id} if user_id is not None else None
+        if isinstance(self.vectorstore, MmapVectorStore):
+            return self.vectorstore.similarity_search_by_vectors(query_embeddings, k=k, filter=where)
+        
+        results = self.vectorstore._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas"]
+        )
+        
+        return [
+            [
+                Document(page_content=content, metadata=metadata or {})
+                for content, metadata in zip(contents, metadatas)
+            ]
+            for contents, metadatas in zip(results["documents"], results["metadatas"])
+        ]
+    
+    async def generate_batch(self, queries, retrieved, generate=True, max_concurrency=4):
+        """按输入顺序逐条产出批量查询结果，生成回答时最多并发max_concurrency个LLM请求"""
+        # 无论调用方传入多少，并发数都不超过服务端上限
+        semaphore = asyncio.Semaphore(max(1, min(max_concurrency, MAX_BATCH_CONCURRENCY)))
+        
+        async def answer(query, docs):
+            async with semaphore:
+                return await self.llm.ainvoke(self._build_prompt(query, docs))
+        
+        tasks = [
+            asyncio.ensure_future(answer(query, docs)) if generate else None
+            for query, docs in zip(queries, retrieved)
+        ]
+        
+        try:
+            for index, (query, docs, task) in enumerate(zip(queries, retrieved, tasks)):
+                result = {
+                    "index": index,
+                    "query": query,
+                    "sources": self._format_sources(docs)
+                }
+                if task is not None:
+                    try:
+                        result["response"] = await task
+                    except Exception as e:
+                        # 单条生成失败不影响其余结果
+                        result["error"] = f"生成回答时出错: {e}"
+                yield result
+        finally:
+            # 客户端中途断开时取消尚未完成的生成任务
+            for task in tasks:
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def _build_prompt(self, query, docs):
+        """根据检索结果构建提示"""
+        context = "\n\n".join([doc.page_content for doc in docs])
+        return f"基于以下上下文回答问题:\n\n{context}\n\n问题: {query}\n\n回答:"
+    
+    def _format_sources(self, docs):
+        """将检索到的文档转换为来源列表"""
+        return [
+            {
+                "title": doc.metadata.get("title", ""),
+                "category": doc.metadata.get("category", ""),
+                "content": doc.page_content
+            } 
+            for doc in docs
+        ]
 
 # 全局RAG系统实例
 rag_system = None
@@ -102,7 +210,7 @@ def initialize_rag_system():
     """初始化RAG系统"""
     global rag_system
     if rag_system is None:
-        rag_system = RAGSystem()
+        rag_system = RAGSystem(index_writer=IndexWriterClient.from_env())
     return rag_system
 
 def get_knowledge_items_from_db():
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 后端模块直接位于backend目录下，测试时加入导入路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+import numpy as np
+from embeddings import HashingEmbeddings, _hash_encode, embedding_signature
+
+TEXTS = ["今天开会讨论了下季度预算", "预算会议改到明天", "周末去爬山", "读书笔记：三体"]
+
+def test_rows_are_l2_normalized():
+    matrix = HashingEmbeddings(n_features=256).encode(TEXTS)
+    assert matrix.shape == (len(TEXTS), 256)
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, rtol=1e-5)
+
+def test_similar_texts_score_higher():
+    matrix = HashingEmbeddings().encode(TEXTS)
+    scores = matrix @ matrix.T
+    assert scores[0, 1] > scores[0, 2]
+    assert scores[0, 1] > scores[0, 3]
+
+def test_empty_string_encodes_to_zero_vector():
+    matrix = HashingEmbeddings(n_features=64).encode(["", "   ", "预算"])
+    assert not matrix[0].any()
+    assert not matrix[1].any()
+    assert np.isclose(np.linalg.norm(matrix[2]), 1.0)
+
+def test_empty_batch():
+    embeddings = HashingEmbeddings(n_features=64)
+    assert embeddings.encode([]).shape == (0, 64)
+    assert embeddings.embed_documents([]) == []
+
+def test_embed_query_matches_embed_documents():
+    embeddings = HashingEmbeddings(n_features=128)
+    assert embeddings.embed_query(TEXTS[0]) == embeddings.embed_documents(TEXTS)[0]
+
+def test_process_pool_matches_inline():
+    texts = TEXTS * 10
+    inline = HashingEmbeddings(workers=0).encode(texts)
+    pooled = HashingEmbeddings(workers=2, process_threshold=10).encode(texts)
+    np.testing.assert_array_equal(inline, pooled)
+
+def test_stable_across_processes():
+    # 不同PYTHONHASHSEED的子进程必须得到完全相同的向量
+    code = (
+        "import sys; from embeddings import _hash_encode; "
+        f"sys.stdout.buffer.write(_hash_encode({TEXTS!r}, 128, (1, 3)).tobytes())"
+    )
+    backend_dir = Path(__file__).resolve().parent.parent
+    outputs = []
+    for seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=backend_dir, env=env, capture_output=True, check=True
+        )
+        outputs.append(result.stdout)
+    assert outputs[0] == outputs[1]
+    assert outputs[0] == _hash_encode(TEXTS, 128, (1, 3)).tobytes()
+
+def test_signature_includes_configuration():
+    assert HashingEmbeddings(n_features=1024, ngram_range=(1, 3)).signature == "hashing:1024:1-3"
+    assert embedding_signature("hashing", HashingEmbeddings(n_features=512, ngram_range=(2, 2))) == "hashing:512:2-2"
+    assert embedding_signature("openai", object()) == "openai"
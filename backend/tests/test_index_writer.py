@@ -0,0 +1,69 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import index_writer
+from index_writer import IndexWriterClient, serve
+
+AUTHKEY = "test-key"
+
+class RecordingRAG:
+    """记录写请求的RAG替身"""
+
+    def __init__(self):
+        self.items = []
+
+    def add_knowledge(self, knowledge_items):
+        self.items.extend(knowledge_items)
+        return len(knowledge_items)
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(index_writer, "WRITER_RECV_TIMEOUT", 0.5)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        address = f"127.0.0.1:{probe.getsockname()[1]}"
+
+    rag_system = RecordingRAG()
+    ready = threading.Event()
+    threading.Thread(target=serve, args=(address, AUTHKEY, ready, rag_system), daemon=True).start()
+    assert ready.wait(5)
+    return address, rag_system
+
+def test_client_forwards_writes(writer):
+    address, rag_system = writer
+    client = IndexWriterClient(address, AUTHKEY)
+
+    assert client.add_knowledge([{"id": 1}]) == 1
+    assert rag_system.items == [{"id": 1}]
+
+def test_silent_connection_does_not_stall_writer(writer):
+    address, rag_system = writer
+    client = IndexWriterClient(address, AUTHKEY)
+
+    # 连上后不做认证握手，写入进程应在超时后放弃该连接
+    with socket.create_connection(index_writer._parse_address(address)):
+        # 在后台线程中调用，写入进程被卡住时测试失败而不是一直挂起
+        call = threading.Thread(target=client.add_knowledge, args=([{"id": 1}],), daemon=True)
+        call.start()
+        call.join(5)
+        assert not call.is_alive()
+    assert rag_system.items == [{"id": 1}]
+
+def test_wrong_authkey_is_rejected(writer):
+    address, rag_system = writer
+
+    with pytest.raises(Exception):
+        IndexWriterClient(address, "wrong-key").add_knowledge([{"id": 1}])
+    assert IndexWriterClient(address, AUTHKEY).add_knowledge([{"id": 2}]) == 1
+    assert rag_system.items == [{"id": 2}]
+
+def test_concurrent_clients_are_all_served(writer):
+    address, rag_system = writer
+    client = IndexWriterClient(address, AUTHKEY)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(lambda i: client.add_knowledge([{"id": i}]), range(32)))
+
+    assert results == [1] * 32
+    assert sorted(item["id"] for item in rag_system.items) == list(range(32))
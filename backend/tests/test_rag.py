@@ -0,0 +1,134 @@
+import asyncio
+import pytest
+import rag
+from rag import RAGSystem, MAX_BATCH_CONCURRENCY
+
+ITEMS = [
+    {"id": 1, "title": "预算", "content": "下季度预算会议改到周五", "category": "工作", "user_id": 1},
+    {"id": 2, "title": "旅行", "content": "周末去杭州旅行爬山", "category": "生活", "user_id": 1},
+    {"id": 3, "title": "读书", "content": "三体读书笔记", "category": "学习", "user_id": 2},
+]
+
+class StubLLM:
+    """按问题返回固定回答的LLM替身，记录并发数和被取消的调用"""
+
+    def __init__(self, delays=None, failures=()):
+        self.delays = delays or {}
+        self.failures = set(failures)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = []
+
+    async def ainvoke(self, prompt):
+        query = prompt.split("问题: ")[1].split("\n")[0]
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(query, 0.01))
+            if query in self.failures:
+                raise RuntimeError("上游超时")
+            return f"回答:{query}"
+        except asyncio.CancelledError:
+            self.cancelled.append(query)
+            raise
+        finally:
+            self.in_flight -= 1
+
+@pytest.fixture
+def rag_system(tmp_path, monkeypatch):
+    # 向量库路径都是相对当前目录的默认值，切到临时目录避免污染仓库
+    monkeypatch.chdir(tmp_path)
+    system = RAGSystem(embedding_backend="hashing", vector_store_backend="mmap")
+    system.add_knowledge(ITEMS)
+    return system
+
+def collect(system, queries, retrieved, **kwargs):
+    async def run():
+        return [result async for result in system.generate_batch(queries, retrieved, **kwargs)]
+    return asyncio.run(run())
+
+@pytest.mark.parametrize("vector_store_backend", ["mmap", "chroma"])
+def test_retrieve_batch_with_hashing_backend(tmp_path, monkeypatch, vector_store_backend):
+    monkeypatch.chdir(tmp_path)
+    system = RAGSystem(embedding_backend="hashing", vector_store_backend=vector_store_backend)
+    system.add_knowledge(ITEMS)
+
+    retrieved = system.retrieve_batch(["三体读书笔记", "预算会议", "杭州旅行"], k=1)
+    assert [docs[0].metadata["title"] for docs in retrieved] == ["读书", "预算", "旅行"]
+
+    filtered = system.retrieve_batch(["三体读书笔记"], user_id=1, k=3)
+    assert {doc.metadata["user_id"] for doc in filtered[0]} == {1}
+
+def test_generate_batch_keeps_input_order(rag_system):
+    queries = ["慢", "中", "快"]
+    rag_system.llm = StubLLM(delays={"慢": 0.1, "中": 0.05, "快": 0.0})
+    retrieved = rag_system.retrieve_batch(queries)
+
+    results = collect(rag_system, queries, retrieved)
+
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert [result["response"] for result in results] == ["回答:慢", "回答:中", "回答:快"]
+    assert all(result["sources"] for result in results)
+
+def test_generate_batch_respects_concurrency_limits(rag_system):
+    queries = [f"问题{i}" for i in range(20)]
+    retrieved = rag_system.retrieve_batch(queries)
+
+    rag_system.llm = StubLLM()
+    collect(rag_system, queries, retrieved, max_concurrency=3)
+    assert rag_system.llm.max_in_flight == 3
+
+    # 超过服务端上限的并发数会被截断
+    rag_system.llm = StubLLM()
+    collect(rag_system, queries, retrieved, max_concurrency=1000)
+    assert rag_system.llm.max_in_flight == MAX_BATCH_CONCURRENCY
+
+def test_generate_batch_reports_per_item_errors(rag_system):
+    queries = ["成功", "失败", "也成功"]
+    rag_system.llm = StubLLM(failures={"失败"})
+    retrieved = rag_system.retrieve_batch(queries)
+
+    results = collect(rag_system, queries, retrieved)
+
+    assert results[0]["response"] == "回答:成功"
+    assert "response" not in results[1]
+    assert "上游超时" in results[1]["error"]
+    assert results[2]["response"] == "回答:也成功"
+
+def test_generate_batch_without_generation(rag_system):
+    queries = ["预算", "读书"]
+    rag_system.llm = StubLLM()
+    retrieved = rag_system.retrieve_batch(queries)
+
+    results = collect(rag_system, queries, retrieved, generate=False)
+
+    assert all("response" not in result for result in results)
+    assert rag_system.llm.max_in_flight == 0
+
+def test_generate_batch_cancels_pending_work_on_close(rag_system):
+    queries = ["快", "慢1", "慢2"]
+    rag_system.llm = StubLLM(delays={"快": 0.0, "慢1": 10, "慢2": 10})
+    retrieved = rag_system.retrieve_batch(queries)
+
+    async def run():
+        stream = rag_system.generate_batch(queries, retrieved)
+        first = await stream.__anext__()
+        # 模拟客户端读完第一条就断开
+        await stream.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    first = asyncio.run(run())
+    assert first["response"] == "回答:快"
+    assert sorted(rag_system.llm.cancelled) == ["慢1", "慢2"]
+
+def test_batch_endpoint_rejects_oversized_requests():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    # 不进入lifespan，参数校验在访问RAG系统之前完成
+    client = TestClient(app)
+    response = client.post("/rag/query/batch", json={"queries": ["问题"] * (rag.MAX_BATCH_QUERIES + 1)})
+    assert response.status_code == 400
+    response = client.post("/rag/query/batch", json={"queries": ["问题"], "max_concurrency": 0})
+    assert response.status_code == 400
@@ -0,0 +1,252 @@
+import sys
+import threading
+import numpy as np
+import pytest
+import vectorstore
+from langchain_core.embeddings import Embeddings
+from embeddings import HashingEmbeddings
+from vectorstore import MmapVectorStore, IVF_MIN_POINTS_PER_LIST
+
+WORDS = ["预算", "会议", "天气", "旅行", "代码", "学习", "音乐", "电影", "跑步", "读书"]
+
+class LookupEmbeddings(Embeddings):
+    """把文本解析为预先生成的向量下标，便于构造可控的向量分布"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[int(text)].tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[int(text)].tolist()
+
+def make_texts(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return ["".join(rng.choice(WORDS, 5)) for _ in range(count)]
+
+def make_store(tmp_path, **kwargs):
+    return MmapVectorStore(HashingEmbeddings(n_features=256), index_path=tmp_path, **kwargs)
+
+def add_items(store, texts, user_ids=None):
+    user_ids = user_ids or [i % 3 for i in range(len(texts))]
+    store.add_texts(
+        texts,
+        metadatas=[{"user_id": user_id, "title": str(i)} for i, user_id in enumerate(user_ids)],
+        ids=[f"{i}-0" for i in range(len(texts))]
+    )
+
+def titles(documents):
+    return [doc.metadata["title"] for doc in documents]
+
+def test_empty_store_returns_no_results(tmp_path):
+    store = make_store(tmp_path)
+    assert store.similarity_search("预算") == []
+
+def test_int8_top_k_matches_float32(tmp_path):
+    texts = make_texts(300)
+    float_store = make_store(tmp_path / "f32", quantization="float32")
+    int8_store = make_store(tmp_path / "i8", quantization="int8")
+    add_items(float_store, texts)
+    add_items(int8_store, texts)
+
+    for query in ["预算会议", "天气旅行", "代码学习音乐"]:
+        expected = float_store.similarity_search_with_score(query, k=5)
+        actual = int8_store.similarity_search_with_score(query, k=5)
+        assert titles(doc for doc, _ in actual)[0] == titles(doc for doc, _ in expected)[0]
+        np.testing.assert_allclose(
+            [score for _, score in actual], [score for _, score in expected], atol=0.02
+        )
+
+def test_upsert_replaces_content_without_duplicates(tmp_path):
+    store = make_store(tmp_path)
+    add_items(store, ["预算会议", "天气很好"], user_ids=[1, 1])
+
+    store.add_texts(["周末旅行"], metadatas=[{"user_id": 1, "title": "0"}], ids=["0-0"])
+
+    results = store.similarity_search("预算会议", k=5)
+    assert sorted(doc.page_content for doc in results) == ["周末旅行", "天气很好"]
+    assert store.similarity_search("周末旅行", k=1)[0].metadata["title"] == "0"
+
+def test_unchanged_items_are_skipped(tmp_path):
+    store = make_store(tmp_path)
+    add_items(store, ["预算会议", "天气很好"])
+    version = store._snapshot.version
+
+    add_items(store, ["预算会议", "天气很好"])
+
+    assert store._snapshot.version == version
+    assert store._snapshot.count == 2
+
+def test_user_id_filter(tmp_path):
+    store = make_store(tmp_path)
+    add_items(store, make_texts(60))
+
+    results = store.similarity_search("预算会议", k=10, filter={"user_id": 2})
+    assert len(results) == 10
+    assert all(doc.metadata["user_id"] == 2 for doc in results)
+    assert store.similarity_search("预算会议", filter={"user_id": 99}) == []
+
+def test_unsupported_filter_raises(tmp_path):
+    store = make_store(tmp_path)
+    with pytest.raises(ValueError):
+        store.similarity_search("预算", filter={"category": "工作"})
+
+def test_batch_search_preserves_query_order(tmp_path):
+    store = make_store(tmp_path)
+    add_items(store, ["预算会议", "天气很好", "读书笔记"])
+    embeddings = HashingEmbeddings(n_features=256)
+
+    results = store.similarity_search_by_vectors(
+        embeddings.embed_documents(["读书笔记", "预算会议"]), k=1
+    )
+    assert [docs[0].page_content for docs in results] == ["读书笔记", "预算会议"]
+
+@pytest.mark.parametrize("quantization", ["float32", "int8"])
+def test_search_across_multiple_blocks(tmp_path, monkeypatch, quantization):
+    store = make_store(tmp_path, quantization=quantization)
+    add_items(store, make_texts(100))
+    expected = store.similarity_search_with_score("预算会议", k=10, filter={"user_id": 1})
+
+    # 每块只放7行，覆盖块边界和按块屏蔽user_id的路径
+    monkeypatch.setattr(vectorstore, "SEARCH_BLOCK_BYTES", 7 * 256 * 4)
+    actual = store.similarity_search_with_score("预算会议", k=10, filter={"user_id": 1})
+
+    assert titles(doc for doc, _ in actual) == titles(doc for doc, _ in expected)
+
+def test_failed_commit_keeps_old_rows_searchable(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    add_items(store, ["预算会议", "天气很好"], user_ids=[1, 1])
+
+    original_set_info = store._set_info
+    def failing_set_info(conn, key, value):
+        if key == "version":
+            raise RuntimeError("磁盘已满")
+        original_set_info(conn, key, value)
+    monkeypatch.setattr(store, "_set_info", failing_set_info)
+
+    with pytest.raises(RuntimeError):
+        store.add_texts(["周末旅行"], metadatas=[{"user_id": 1, "title": "0"}], ids=["0-0"])
+
+    monkeypatch.undo()
+    assert store.similarity_search("预算会议", k=1, filter={"user_id": 1})[0].page_content == "预算会议"
+
+def test_concurrent_reads_during_writes(tmp_path):
+    store = make_store(tmp_path)
+    add_items(store, make_texts(50))
+    errors = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            try:
+                store.similarity_search("预算会议", k=5)
+                store.similarity_search("天气旅行", k=5, filter={"user_id": 1})
+            except Exception as e:
+                errors.append(e)
+                return
+
+    # 频繁切换线程，放大刷新与检索交错的机会
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for batch in range(80):
+            texts = make_texts(10, seed=batch + 1)
+            store.add_texts(
+                texts,
+                metadatas=[{"user_id": i % 3} for i in range(len(texts))],
+                ids=[f"{batch}-{i}" for i in range(len(texts))]
+            )
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    # 每次写入都追加新行，包括与初始数据id重复的更新
+    assert store._snapshot.count == 50 + 800
+
+def test_dimension_mismatch_raises(tmp_path):
+    add_items(make_store(tmp_path), ["预算会议"])
+    store = MmapVectorStore(HashingEmbeddings(n_features=128), index_path=tmp_path)
+    with pytest.raises(ValueError):
+        store.add_texts(["天气"], ids=["1-0"])
+
+@pytest.mark.parametrize("quantization", ["float32", "int8"])
+def test_ivf_recall(tmp_path, quantization):
+    # 围绕16个中心生成聚类数据，IVF只探测部分分区时召回率应接近暴力检索
+    rng = np.random.default_rng(0)
+    nlist = 16
+    centers = rng.normal(size=(nlist, 32))
+    vectors = np.vstack([
+        center + 0.3 * rng.normal(size=(IVF_MIN_POINTS_PER_LIST * 2, 32)) for center in centers
+    ]).astype(np.float32)
+    texts = [str(i) for i in range(len(vectors))]
+    embeddings = LookupEmbeddings(vectors)
+
+    brute = MmapVectorStore(embeddings, index_path=tmp_path / "brute", quantization=quantization)
+    ivf = MmapVectorStore(embeddings, index_path=tmp_path / "ivf", quantization=quantization,
+                          ivf_nlist=nlist, ivf_nprobe=4)
+    brute.add_texts(texts, ids=texts)
+    ivf.add_texts(texts, ids=texts)
+    assert brute._snapshot.centroids is None
+    assert ivf._snapshot.centroids is not None
+
+    queries = vectors[rng.choice(len(vectors), 50, replace=False)]
+    expected = brute.similarity_search_by_vectors(queries, k=10)
+    actual = ivf.similarity_search_by_vectors(queries, k=10)
+    hits = sum(
+        len({doc.page_content for doc in a} & {doc.page_content for doc in e})
+        for a, e in zip(actual, expected)
+    )
+    assert hits / (10 * len(queries)) >= 0.9
+
+def test_second_instance_sees_writes(tmp_path):
+    reader = make_store(tmp_path)
+    writer = make_store(tmp_path)
+    assert reader.similarity_search("预算会议") == []
+
+    add_items(writer, ["预算会议", "天气很好"], user_ids=[1, 1])
+    assert reader.similarity_search("预算会议", k=1)[0].page_content == "预算会议"
+
+    writer.add_texts(["周末旅行"], metadatas=[{"user_id": 1, "title": "0"}], ids=["0-0"])
+    results = reader.similarity_search("预算会议", k=5, filter={"user_id": 1})
+    assert sorted(doc.page_content for doc in results) == ["周末旅行", "天气很好"]
+
+def test_collection_metadata_is_kept_from_first_creation(tmp_path):
+    make_store(tmp_path, collection_metadata={"embedding_backend": "hashing:256:1-3"})
+    store = make_store(tmp_path, collection_metadata={"embedding_backend": "openai"})
+    assert store.metadata == {"embedding_backend": "hashing:256:1-3"}
+
+def test_read_only_requires_existing_index(tmp_path):
+    with pytest.raises(ValueError):
+        MmapVectorStore(HashingEmbeddings(n_features=256), index_path=tmp_path / "missing", read_only=True)
+    assert not (tmp_path / "missing").exists()
+
+def snapshot_files(path):
+    # -wal/-shm是SQLite WAL模式下读者协调用的共享内存文件，不属于索引数据
+    return {
+        file.name: file.read_bytes()
+        for file in path.iterdir()
+        if not file.name.endswith(("-wal", "-shm"))
+    }
+
+def test_read_only_store_never_writes(tmp_path):
+    writer = make_store(tmp_path)
+    add_items(writer, ["预算会议", "天气很好"], user_ids=[1, 1])
+    snapshot = snapshot_files(tmp_path)
+
+    reader = MmapVectorStore(HashingEmbeddings(n_features=256), index_path=tmp_path, read_only=True)
+    assert reader.similarity_search("预算会议", k=1)[0].page_content == "预算会议"
+    with pytest.raises(ValueError):
+        reader.add_texts(["周末旅行"], ids=["2-0"])
+    with pytest.raises(ValueError):
+        reader.build_ivf(1)
+    assert snapshot_files(tmp_path) == snapshot
+
+    writer.add_texts(["周末旅行"], metadatas=[{"user_id": 1, "title": "0"}], ids=["0-0"])
+    assert reader.similarity_search("周末旅行", k=1)[0].page_content == "周末旅行"
@@ -0,0 +1,479 @@
+import os
+import json
+import uuid
+import sqlite3
+import threading
+from collections import namedtuple
+from pathlib import Path
+import numpy as np
+from langchain_core.vectorstores import VectorStore
+from langchain.docstore.document import Document
+
+# 内存映射向量索引配置
+MMAP_INDEX_PATH = os.getenv("MMAP_INDEX_PATH", "./vector_index")
+# 向量存储精度，可选: float32 / int8
+MMAP_QUANTIZATION = os.getenv("MMAP_QUANTIZATION", "float32")
+# IVF分区数，0表示关闭IVF，始终暴力检索
+MMAP_IVF_NLIST = int(os.getenv("MMAP_IVF_NLIST", "0"))
+MMAP_IVF_NPROBE = int(os.getenv("MMAP_IVF_NPROBE", "8"))
+# 每个分区至少约39个样本k-means质心才稳定（faiss采用同样的下限），不足时继续暴力检索
+IVF_MIN_POINTS_PER_LIST = 39
+
+# 每次参与矩阵乘法的向量块大小（按反量化后的float32字节数计），限制检索时的临时内存
+SEARCH_BLOCK_BYTES = 32 * 1024 * 1024
+# 元数据中没有user_id时使用的占位值
+NO_USER_ID = -1
+# 被新版本替换的旧行的user_id标记，检索时排除
+DELETED_USER_ID = -2
+
+# 某一版本索引的只读快照，整体替换，检索时只使用同一个快照，避免读到新旧混合的映射
+IndexSnapshot = namedtuple(
+    "IndexSnapshot", ["version", "count", "dim", "vectors", "user_ids", "scales", "centroids", "assign"]
+)
+
+class MmapVectorStore(VectorStore):
+    """基于内存映射文件的进程内向量索引
+
+    向量按行存放在定长文件中，多个uvicorn worker以只读方式映射同一文件，
+    共享操作系统页缓存而不各自复制。id、正文和元数据存放在SQLite侧表中。
+    写入只追加新行，更新过的条目在旧行上留下删除标记，文件随修改次数增长。
+    过滤条件仅支持按 user_id 精确匹配。
+    read_only=True 时只读打开已有索引，不建表也不修改任何文件，供多进程模式下的请求worker使用。
+    """
+
+    def __init__(self, embedding_function, index_path=MMAP_INDEX_PATH,
+                 quantization=MMAP_QUANTIZATION, ivf_nlist=MMAP_IVF_NLIST,
+                 ivf_nprobe=MMAP_IVF_NPROBE, collection_metadata=None, read_only=False):
+        if quantization not in ("float32", "int8"):
+            raise ValueError(f"不支持的量化方式: {quantization}")
+
+        self.embedding_function = embedding_function
+        self.index_path = Path(index_path)
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.read_only = read_only
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+        if read_only:
+            if not (self.index_path / "meta.db").exists():
+                raise ValueError(f"向量索引 {self.index_path} 不存在，需先由索引写入进程创建")
+        else:
+            self.index_path.mkdir(parents=True, exist_ok=True)
+            self._init_side_table(quantization, collection_metadata or {})
+        self.quantization = self._get_info("quantization")
+        self.metadata = json.loads(self._get_info("collection_metadata"))
+
+        self._snapshot = None
+        self._refresh()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    # ---------- 侧表与文件 ----------
+
+    def _connect(self):
+        if self.read_only:
+            conn = sqlite3.connect(f"file:{self.index_path / 'meta.db'}?mode=ro", uri=True)
+        else:
+            conn = sqlite3.connect(self.index_path / "meta.db")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_side_table(self, quantization, collection_metadata):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS info (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        # 与Chroma的集合元数据一致，只在首次创建时写入
+        defaults = {
+            "count": "0",
+            "dim": "0",
+            "version": "0",
+            "ivf_nlist": "0",
+            "quantization": quantization,
+            "collection_metadata": json.dumps(collection_metadata, ensure_ascii=False)
+        }
+        cursor.executemany(
+            "INSERT OR IGNORE INTO info (key, value) VALUES (?, ?)",
+            list(defaults.items())
+        )
+        conn.commit()
+        conn.close()
+
+    def _get_info(self, key, conn=None):
+        own_conn = conn is None
+        conn = conn or self._connect()
+        row = conn.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        if own_conn:
+            conn.close()
+        return row["value"]
+
+    def _set_info(self, conn, key, value):
+        conn.execute("UPDATE info SET value = ? WHERE key = ?", (str(value), key))
+
+    def _file(self, name):
+        return self.index_path / name
+
+    def _map(self, name, dtype, shape):
+        """以只读方式映射文件，行数为0时返回空数组"""
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    def _map_for_write(self, name, dtype, shape):
+        """扩展文件到所需大小后以读写方式映射"""
+        path = self._file(name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("向量索引以只读方式打开，写操作需交给索引写入进程")
+
+    def _vector_dtype(self):
+        return np.int8 if self.quantization == "int8" else np.float32
+
+    def _refresh(self):
+        """索引被其他进程或线程写入后重新映射文件，无需重启即可读到新数据，返回当前快照"""
+        conn = self._connect()
+        version = int(self._get_info("version", conn))
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            conn.close()
+            return snapshot
+        count = int(self._get_info("count", conn))
+        dim = int(self._get_info("dim", conn))
+        nlist = int(self._get_info("ivf_nlist", conn))
+        conn.close()
+
+        snapshot = IndexSnapshot(
+            version=version,
+            count=count,
+            dim=dim,
+            vectors=self._map("vectors.bin", self._vector_dtype(), (count, dim)),
+            user_ids=self._map("user_ids.bin", np.int64, (count,)),
+            scales=self._map("scales.bin", np.float32, (count,)) if self.quantization == "int8" else None,
+            centroids=np.load(self._file("centroids.npy")) if nlist else None,
+            assign=self._map("assign.bin", np.int32, (count,)) if nlist else None
+        )
+        # 并发刷新时只允许更新的版本覆盖旧版本
+        with self._refresh_lock:
+            if self._snapshot is None or self._snapshot.version < snapshot.version:
+                self._snapshot = snapshot
+            return self._snapshot
+
+    # ---------- 写入 ----------
+
+    def _quantize(self, vectors):
+        """按行对称量化为int8，返回量化结果与每行的缩放系数"""
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _lookup_chunks(self, conn, ids):
+        """按id查询侧表中已有的行号、正文和元数据"""
+        existing = {}
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for item in conn.execute(f"SELECT id, row, content, metadata FROM chunks WHERE id IN ({placeholders})", batch):
+                existing[item["id"]] = item
+        return existing
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """写入文本向量，已存在的id写到新行并将旧行标记为删除，内容未变的条目直接跳过"""
+        self._check_writable()
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [str(i) for i in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+
+        # 同一批次内重复的id以最后一次为准
+        latest = {chunk_id: (text, json.dumps(metadata, ensure_ascii=False), metadata)
+                  for chunk_id, text, metadata in zip(ids, texts, metadatas)}
+
+        # 重复更新时大部分条目没有变化，跳过它们可以省去嵌入请求和文件增长
+        conn = self._connect()
+        existing = self._lookup_chunks(conn, list(latest))
+        conn.close()
+        changed = [
+            chunk_id for chunk_id, (text, metadata_json, _) in latest.items()
+            if chunk_id not in existing
+            or existing[chunk_id]["content"] != text
+            or existing[chunk_id]["metadata"] != metadata_json
+        ]
+        if not changed:
+            return ids
+
+        vectors = _normalize(np.asarray(
+            self.embedding_function.embed_documents([latest[chunk_id][0] for chunk_id in changed]),
+            dtype=np.float32
+        ))
+
+        with self._write_lock:
+            conn = self._connect()
+            try:
+                # BEGIN IMMEDIATE 让同一索引上的写入者互斥
+                conn.execute("BEGIN IMMEDIATE")
+                count = int(self._get_info("count", conn))
+                dim = int(self._get_info("dim", conn)) or vectors.shape[1]
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {dim} 不一致")
+
+                # 所有写入都追加到新行，从不原位修改读者可能正在读取的行
+                new_count = count + len(changed)
+                rows = np.arange(count, new_count, dtype=np.int64)
+                old_rows = np.asarray(
+                    [item["row"] for item in self._lookup_chunks(conn, changed).values()],
+                    dtype=np.int64
+                )
+                user_ids = np.asarray(
+                    [NO_USER_ID if latest[chunk_id][2].get("user_id") is None else int(latest[chunk_id][2]["user_id"])
+                     for chunk_id in changed],
+                    dtype=np.int64
+                )
+
+                # 先写新行，再提交侧表；读者看到新行数时新行数据已就绪
+                vector_map = self._map_for_write("vectors.bin", self._vector_dtype(), (new_count, dim))
+                if self.quantization == "int8":
+                    quantized, scales = self._quantize(vectors)
+                    vector_map[count:] = quantized
+                    scale_map = self._map_for_write("scales.bin", np.float32, (new_count,))
+                    scale_map[count:] = scales
+                    scale_map.flush()
+                else:
+                    vector_map[count:] = vectors
+                vector_map.flush()
+
+                nlist = int(self._get_info("ivf_nlist", conn))
+                if nlist:
+                    centroids = np.load(self._file("centroids.npy"))
+                    assign_map = self._map_for_write("assign.bin", np.int32, (new_count,))
+                    assign_map[count:] = np.argmax(vectors @ centroids.T, axis=1)
+                    assign_map.flush()
+
+                user_map = self._map_for_write("user_ids.bin", np.int64, (new_count,))
+                user_map[count:] = user_ids
+                user_map.flush()
+
+                conn.executemany("DELETE FROM chunks WHERE row = ?", [(int(row),) for row in old_rows])
+                conn.executemany(
+                    "INSERT INTO chunks (row, id, content, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (int(row), chunk_id, latest[chunk_id][0], latest[chunk_id][1])
+                        for row, chunk_id in zip(rows, changed)
+                    ]
+                )
+                self._set_info(conn, "count", new_count)
+                self._set_info(conn, "dim", dim)
+                self._set_info(conn, "version", int(self._get_info("version", conn)) + 1)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+            # 提交成功后才把旧行的user_id改为删除标记，回滚时旧条目保持可检索；
+            # 标记之前旧行即使被检索到，也因侧表中已没有对应正文而被丢弃
+            user_map[old_rows] = DELETED_USER_ID
+            user_map.flush()
+
+        # 达到训练规模后自动建立IVF分区
+        if self.ivf_nlist and not nlist and new_count >= self.ivf_nlist * IVF_MIN_POINTS_PER_LIST:
+            self.build_ivf(self.ivf_nlist)
+
+        self._refresh()
+        return ids
+
+    def build_ivf(self, nlist, iterations=10):
+        """用k-means训练IVF质心，并为所有已有向量分配分区"""
+        self._check_writable()
+        with self._write_lock:
+            snapshot = self._refresh()
+            vectors = np.asarray(self._dequantize(snapshot, 0, snapshot.count))
+            if len(vectors) < nlist:
+                raise ValueError(f"向量数量 {len(vectors)} 少于分区数 {nlist}")
+
+            rng = np.random.default_rng(0)
+            centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assign = np.argmax(vectors @ centroids.T, axis=1)
+                for i in range(nlist):
+                    members = vectors[assign == i]
+                    if len(members):
+                        centroids[i] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+            assign = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # 先写临时文件再原子替换，其他进程刷新时不会读到写了一半的文件
+                _atomic_write(self._file("centroids.npy"), lambda f: np.save(f, centroids))
+                _atomic_write(self._file("assign.bin"), lambda f: f.write(assign.tobytes()))
+                self._set_info(conn, "ivf_nlist", nlist)
+                self._set_info(conn, "version", int(self._get_info("version", conn)) + 1)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        self._refresh()
+
+    # ---------- 检索 ----------
+
+    def _dequantize(self, snapshot, start, end, local_rows=None):
+        """读取一段连续行的float32向量，local_rows不为空时只取段内的这些行"""
+        block = snapshot.vectors[start:end]
+        scales = snapshot.scales[start:end] if snapshot.scales is not None else None
+        if local_rows is not None:
+            block = block[local_rows]
+            scales = scales[local_rows] if scales is not None else None
+        if scales is None:
+            return block
+        return block.astype(np.float32) * scales[:, None]
+
+    def _search_rows(self, query_vectors, k, user_id=None):
+        """批量暴力top-k，返回每个查询的(行号, 分数)列表"""
+        snapshot = self._refresh()
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        if snapshot.count == 0:
+            return [[] for _ in queries]
+
+        probes = None
+        if snapshot.centroids is not None:
+            nprobe = min(self.ivf_nprobe, len(snapshot.centroids))
+            probes = np.argsort(-(queries @ snapshot.centroids.T), axis=1)[:, :nprobe]
+            probe_union = np.unique(probes)
+
+        # 按连续块扫描映射文件，user_id和删除标记只在分数上屏蔽，不按行号复制整个向量文件
+        scores = np.full((snapshot.count, len(queries)), -np.inf, dtype=np.float32)
+        block_rows = max(1, SEARCH_BLOCK_BYTES // (max(snapshot.dim, 1) * 4))
+        for start in range(0, snapshot.count, block_rows):
+            end = min(start + block_rows, snapshot.count)
+            block_user_ids = np.asarray(snapshot.user_ids[start:end])
+            if user_id is None:
+                valid = block_user_ids != DELETED_USER_ID
+            else:
+                valid = block_user_ids == user_id
+
+            if probes is None:
+                if not valid.any():
+                    continue
+                block_scores = self._dequantize(snapshot, start, end) @ queries.T
+                block_scores[~valid] = -np.inf
+                scores[start:end] = block_scores
+                continue
+
+            # IVF只计算块内落在探测分区中的行，每个查询再只保留自身探测到的分区
+            block_assign = np.asarray(snapshot.assign[start:end])
+            local_rows = np.flatnonzero(valid & np.isin(block_assign, probe_union))
+            if len(local_rows) == 0:
+                continue
+            block_scores = self._dequantize(snapshot, start, end, local_rows) @ queries.T
+            row_assign = block_assign[local_rows]
+            for j in range(len(queries)):
+                block_scores[~np.isin(row_assign, probes[j]), j] = -np.inf
+            scores[start + local_rows] = block_scores
+
+        k = min(k, snapshot.count)
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        results = []
+        for j in range(len(queries)):
+            candidates = top[:, j]
+            candidates = candidates[np.argsort(-scores[candidates, j])]
+            results.append([
+                (int(c), float(scores[c, j]))
+                for c in candidates
+                if np.isfinite(scores[c, j])
+            ])
+        return results
+
+    def _load_documents(self, hits):
+        row_ids = list({row for row, _ in hits})
+        documents = {}
+        conn = self._connect()
+        for start in range(0, len(row_ids), 500):
+            batch = row_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for item in conn.execute(f"SELECT row, content, metadata FROM chunks WHERE row IN ({placeholders})", batch):
+                documents[item["row"]] = Document(
+                    page_content=item["content"],
+                    metadata=json.loads(item["metadata"])
+                )
+        conn.close()
+        return documents
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k=4, filter=None):
+        """多个查询向量一次完成检索，结果顺序与输入一致"""
+        user_id = _user_id_from_filter(filter)
+        hits = self._search_rows(embeddings, k, user_id)
+        documents = self._load_documents([hit for query_hits in hits for hit in query_hits])
+        return [
+            [(documents[row], score) for row, score in query_hits if row in documents]
+            for query_hits in hits
+        ]
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None):
+        return [
+            [doc for doc, _ in query_results]
+            for query_results in self.similarity_search_by_vectors_with_score(embeddings, k, filter)
+        ]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vectors([embedding], k, filter)[0]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vectors_with_score([embedding], k, filter)[0]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+def _atomic_write(path, write):
+    """写入同目录下的临时文件后用os.replace整体替换目标文件"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _normalize(vectors):
+    """L2归一化，之后内积即余弦相似度"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _user_id_from_filter(filter):
+    if not filter:
+        return None
+    if set(filter) != {"user_id"}:
+        raise ValueError(f"内存映射索引仅支持按 user_id 过滤: {filter}")
+    return int(filter["user_id"])